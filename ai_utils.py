@@ -1,10 +1,18 @@
 import os
-import base64
+import re
+import logging
+import json
+import random
+import binascii
 from io import BytesIO
+import httpx
 import openai
 from dotenv import load_dotenv
+import streamlit as st
 from PIL import Image
-import numpy as np
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'), override=True)
@@ -12,31 +20,73 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)),
 # Get API key
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
-    print("Warning: OpenAI API key not found in environment variables")
-else:
-    # Print the API key for debugging (first 4 and last 4 characters)
-    if len(api_key) > 8:
-        print(f"API Key loaded: {api_key[:4]}...{api_key[-4:]}")
-    else:
-        print(f"API Key loaded but seems invalid: {api_key}")
+    logger.warning("OpenAI API key not found in environment variables")
+elif len(api_key) <= 8:
+    logger.warning("OpenAI API key loaded but seems invalid")
+
+# Keep-alive pool shared by all requests so TCP/TLS sessions are reused across calls
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+@st.cache_resource(show_spinner=False)
+def _create_openai_client(key):
+    """Create one OpenAI client per API key, shared across Streamlit reruns and sessions"""
+    return openai.OpenAI(api_key=key,
+                         http_client=httpx.Client(http2=True, limits=HTTP_LIMITS))
+
+def get_openai_client(key=None):
+    """Return the shared OpenAI client for key (default: OPENAI_API_KEY), or None if unavailable"""
+    key = key or os.getenv("OPENAI_API_KEY")
+    if not key:
+        return None
+    try:
+        return _create_openai_client(key)
+    except Exception as e:
+        logger.error("Error initializing OpenAI client: %s", e)
+        return None
+
+# Longest edge and JPEG quality used for images sent to the vision model
+MAX_IMAGE_EDGE = 1024
+JPEG_QUALITY = 80
+# Image files larger than this are re-encoded instead of being sent as-is
+MAX_RAW_IMAGE_BYTES = 500 * 1024
 
-# Initialize OpenAI client
-try:
-    client = openai.OpenAI(api_key=api_key)
-    print("OpenAI client initialized successfully")
-except Exception as e:
-    print(f"Error initializing OpenAI client: {e}")
-    client = None
+# Matches everything that isn't a digit, for cleaning up prices
+_DIGITS_RE = re.compile(r'\D+')
+
+# Patterns for picking completed values out of a partially streamed JSON response
+PARTIAL_FIELD_RE = re.compile(r'"(category|title|price|location)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+PARTIAL_FEATURES_RE = re.compile(r'"features"\s*:\s*\[')
+JSON_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+ARRAY_SEPARATOR_RE = re.compile(r'[\s,]*')
 
 def encode_image(image_path):
-    """Convert image to base64 encoding for API requests"""
+    """Convert image to base64 encoding for API requests
+    
+    Small files are sent as-is; larger ones are downscaled and re-encoded via encode_pil_image.
+    """
+    if os.stat(image_path).st_size > MAX_RAW_IMAGE_BYTES:
+        with Image.open(image_path) as image:
+            # For JPEGs, let libjpeg convert to RGB and downscale during decode
+            image.draft("RGB", (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+            image.load()
+            return encode_pil_image(image)
+    
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        return binascii.b2a_base64(image_file.read(), newline=False).decode('ascii')
 
 def encode_pil_image(pil_image):
     """Convert PIL image to base64 encoding for API requests"""
+    return binascii.b2a_base64(encode_pil_image_jpeg(pil_image), newline=False).decode('ascii')
+
+def encode_pil_image_jpeg(pil_image):
+    """Downscale and encode a PIL image as the JPEG bytes sent to the Vision API"""
     buffered = BytesIO()
     
+    # Downscale large photos before encoding (copy so the caller's image is untouched)
+    if max(pil_image.size) > MAX_IMAGE_EDGE:
+        pil_image = pil_image.copy()
+        pil_image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    
     # Convert RGBA to RGB if needed
     if pil_image.mode == 'RGBA':
         # Create a white background image
@@ -49,137 +99,223 @@ def encode_pil_image(pil_image):
         pil_image = pil_image.convert('RGB')
         
     # Save as JPEG
-    pil_image.save(buffered, format="JPEG", quality=90)
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
-
-def extract_field(text, field_name):
-    """Extract a field from the analysis text"""
-    lines = text.split('\n')
-    for line in lines:
-        if line.strip().startswith(field_name):
-            return line.split(field_name, 1)[1].strip().strip(':').strip()
-    return ""
-
-def analyze_image(image, use_fallback=False):
-    """Analyze image using OpenAI Vision API to detect category, generate title, features, and suggest price"""
-    # Check if we should use fallback mode
-    if use_fallback or client is None:
-        print("Using fallback analysis without API call.")
-        return get_fallback_analysis()
+    pil_image.save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffered.getvalue()
+
+# Prompt for the vision model analysis
+ANALYSIS_PROMPT = """
+    You are an expert in second-hand item listing for Indian marketplace. Analyze this image and provide:
+    1. category: What type of item is this? (e.g., furniture, electronics, clothing)
+    2. title: Create a catchy, concise title (max 10 words)
+    3. features: List 3-5 key features (each under 10 words)
+    4. price: Estimate a fair price in INR based on visible condition and category (digits only, no symbol)
+    5. location: If you can identify any location information in the image or metadata, mention it. Otherwise, leave blank.
+    6. flyer_prompt: A one-paragraph prompt for an image model to turn this photo into an eye-catching
+       marketplace listing flyer showing the title, key features and price (Rs.)
     
-    # Print the full API key for debugging
-    print(f"Full API Key being used: {api_key}")
+    Respond with a JSON object containing exactly these fields.
+    """
+
+# Structured output schema matching ANALYSIS_PROMPT, so the response parses with a single json.loads
+ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "listing_analysis",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "category": {"type": "string"},
+                "title": {"type": "string"},
+                "features": {"type": "array", "items": {"type": "string"}},
+                "price": {"type": "string"},
+                "location": {"type": "string"},
+                "flyer_prompt": {"type": "string"}
+            },
+            "required": ["category", "title", "features", "price", "location", "flyer_prompt"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Transient API errors worth retrying (rate limits, timeouts, dropped connections, 5xx)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+vision_retry = retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(min=1, max=8),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    reraise=True
+)
+
+@vision_retry
+def _call_vision(client, messages, stream=False):
+    """Send the analysis request to gpt-4o-mini, retrying transient errors with backoff
     
-    # Convert PIL image to base64
-    if isinstance(image, str):
-        # If image is a file path
-        base64_image = encode_image(image)
+    The SDK's own retries are disabled for this call so tenacity is the only retry layer.
+    """
+    return client.with_options(max_retries=0).chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        max_tokens=700,
+        response_format=ANALYSIS_RESPONSE_FORMAT,
+        stream=stream
+    )
+
+def _image_content_part(image, image_url=None):
+    """Build the image_url content part for one image"""
+    # Convert PIL image to base64 unless the API can fetch it from a URL
+    if image_url:
+        logger.debug("Sending image by URL instead of base64")
+        image_source_url = image_url
     else:
-        # If image is a PIL Image
-        base64_image = encode_pil_image(image)
+        if isinstance(image, str):
+            # If image is a file path
+            base64_image = encode_image(image)
+        else:
+            # If image is a PIL Image
+            base64_image = encode_pil_image(image)
+        logger.debug("Base64 image length: %d", len(base64_image))
+        image_source_url = f"data:image/jpeg;base64,{base64_image}"
     
-    # Create prompt for OpenAI
-    prompt = """
-    You are an expert in second-hand item listing for Indian marketplace. Analyze this image and provide:
-    1. Category: What type of item is this? (e.g., furniture, electronics, clothing)
-    2. Title: Create a catchy, concise title (max 10 words)
-    3. Features: List 3-5 key features as bullet points (each under 10 words)
-    4. Price: Estimate a fair price in INR based on visible condition and category
-    5. Location: If you can identify any location information in the image or metadata, mention it. Otherwise, leave blank.
-    
-    Format your response exactly like this:
-    Category: [category]
-    Title: [title]
-    Features:
-    - [feature 1]
-    - [feature 2]
-    - [feature 3]
-    Price: [price in INR without symbol]
-    Location: [location if visible, otherwise leave blank]
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": image_source_url,
+            "detail": "low"
+        }
+    }
+
+def build_analysis_messages(image, image_url=None):
+    """Build the chat messages for analyzing an image
+    
+    image may also be a list of photos of the same item, which are all sent in a single
+    request. If image_url is provided (e.g. a pre-signed S3 URL, or a list matching the
+    images with None entries), it is sent to the API directly instead of inlining the
+    image as a base64 data URL.
     """
+    images = image if isinstance(image, list) else [image]
+    image_urls = image_url if isinstance(image_url, list) else [image_url] * len(images)
+    
+    prompt = ANALYSIS_PROMPT
+    if len(images) > 1:
+        prompt = f"These {len(images)} photos show the SAME item from different angles. Analyze them together.\n" + prompt
+    
+    content = [{"type": "text", "text": prompt}]
+    content.extend(_image_content_part(img, url) for img, url in zip(images, image_urls))
+    return [
+        {
+            "role": "user",
+            "content": content
+        }
+    ]
+
+def parse_analysis_text(analysis_text):
+    """Parse the JSON analysis response into a result dict"""
+    fields = json.loads(analysis_text)
+    category = fields.get("category", "")
+    logger.debug("Extracted category: %s", category)
+    title = fields.get("title", "")
+    logger.debug("Extracted title: %s", title)
+    
+    features = [f.strip() for f in fields.get("features", []) if f.strip()]
+    if not features:
+        features = ["Quality item in good condition"]
+    logger.debug("Extracted features: %s", features)
+    
+    price = fields.get("price", "")
+    logger.debug("Raw price: %s", price)
+    # Clean up price (remove INR, commas, etc.)
+    price = _DIGITS_RE.sub('', str(price))
+    if not price:
+        logger.debug("No valid price found, using default")
+        price = "1000"  # Default price
+    price = int(price)
+    logger.debug("Final price: %s", price)
+        
+    return {
+        'category': category,
+        'title': title,
+        'features': features,
+        'price': price,
+        'location': fields.get("location", ""),
+        'flyer_prompt': fields.get("flyer_prompt", "")
+    }
+
+def parse_partial_fields(analysis_text):
+    """Extract whatever fields are complete so far in a partially streamed JSON response"""
+    # Matched values are complete JSON strings, so json.loads undoes any escapes
+    partial = {name: json.loads(f'"{value}"') for name, value in reversed(PARTIAL_FIELD_RE.findall(analysis_text))}
+    features_match = PARTIAL_FEATURES_RE.search(analysis_text)
+    if features_match:
+        # Walk the array one quoted string at a time, so a ']' inside a feature doesn't end it;
+        # stop at the closing (unquoted) ']' or at a string that hasn't finished streaming
+        features = []
+        pos = features_match.end()
+        while True:
+            pos = ARRAY_SEPARATOR_RE.match(analysis_text, pos).end()
+            feature_match = JSON_STRING_RE.match(analysis_text, pos)
+            if not feature_match:
+                break
+            features.append(json.loads(f'"{feature_match.group(1)}"'))
+            pos = feature_match.end()
+        partial['features'] = features
+    return partial
+
+def analyze_image(image, use_fallback=False, image_url=None, on_partial=None):
+    """Analyze image using OpenAI Vision API to detect category, generate title, features, and suggest price
+    
+    image may be a single image or a list of photos of the same item (analyzed in one call).
+    If image_url is provided (e.g. a pre-signed S3 URL), it is sent to the API directly
+    instead of inlining the image as a base64 data URL.
+    
+    If on_partial is provided, the response is streamed and on_partial is called with
+    the fields parsed so far (see parse_partial_fields) each time a new value completes.
+    
+    The result also includes 'flyer_prompt', a ready-made prompt for the flyer image model.
+    """
+    # Check if we should use fallback mode
+    client = None if use_fallback else get_openai_client()
+    if client is None:
+        logger.info("Using fallback analysis without API call.")
+        return get_fallback_analysis()
     
     try:
         # Use only gpt-4o-mini for image analysis
-        print("Using GPT-4o-mini for image analysis...")
-        print(f"Image type: {type(image)}")
-        print(f"Image mode: {image.mode if hasattr(image, 'mode') else 'Unknown'}") 
-        print(f"Image size: {image.size if hasattr(image, 'size') else 'Unknown'}") 
-        print(f"Base64 image length: {len(base64_image) if base64_image else 'Unknown'}")
+        logger.debug("Analyzing %s with GPT-4o-mini (mode=%s, size=%s)", type(image).__name__,
+                     getattr(image, 'mode', 'Unknown'), getattr(image, 'size', 'Unknown'))
+        messages = build_analysis_messages(image, image_url)
         try:
-            print("Sending request to OpenAI API...")
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=500
-            )
-            print("Received response from OpenAI API")
-            analysis_text = response.choices[0].message.content
-            print(f"Analysis text received: {analysis_text[:100]}...")
-        except Exception as api_error:
-            print(f"OpenAI API error: {api_error}")
-            import traceback
-            print("API call traceback:")
-            traceback.print_exc()
+            if on_partial is None:
+                response = _call_vision(client, messages)
+                analysis_text = response.choices[0].message.content
+            else:
+                analysis_text = ""
+                last_partial = {}
+                for chunk in _call_vision(client, messages, stream=True):
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    analysis_text += delta
+                    # Re-parse only when a string value may have closed, and report only changes
+                    if '"' in delta:
+                        partial = parse_partial_fields(analysis_text)
+                        if partial != last_partial:
+                            on_partial(partial)
+                            last_partial = partial
+            logger.debug("Analysis text received: %.100s...", analysis_text)
+        except Exception:
+            logger.exception("OpenAI API error")
             raise
     
-        # Parse the analysis text
-        print("Parsing analysis text...")
-        category = extract_field(analysis_text, "Category:")
-        print(f"Extracted category: {category}")
-        title = extract_field(analysis_text, "Title:")
-        print(f"Extracted title: {title}")
-        
-        # Check if we have features or description
-        print("Extracting features...")
-        if "Features:" in analysis_text:
-            print("Features section found in analysis")
-            features_text = analysis_text.split("Features:")[1].split("Price:")[0].strip()
-            # Extract bullet points
-            features = [f.strip().lstrip('-').strip() for f in features_text.split('\n') if f.strip()]
-            print(f"Extracted features: {features}")
-        else:
-            print("No Features section found, looking for Description")
-            # Fall back to description if no features
-            description = extract_field(analysis_text, "Description:")
-            # Create features from description
-            features = [description[:40] + "..."] if description else ["Quality item in good condition"]
-            print(f"Created features from description: {features}")
-        
-        print("Extracting price...")
-        price = extract_field(analysis_text, "Price:")
-        print(f"Raw price: {price}")
-        # Clean up price (remove INR, commas, etc.)
-        price = ''.join(c for c in price if c.isdigit())
-        if not price:
-            print("No valid price found, using default")
-            price = "1000"  # Default price
-        print(f"Final price: {price}")
-            
-        # Extract location if available
-        location = ""
-        if "Location:" in analysis_text:
-            location = extract_field(analysis_text, "Location:")
-            
-        return {
-            'category': category,
-            'title': title,
-            'features': features,
-            'price': price,
-            'location': location
-        }
+        return parse_analysis_text(analysis_text)
     except Exception as e:
-        print(f"Error in AI analysis: {e}")
+        logger.error("Error in AI analysis: %s", e)
         return get_fallback_analysis()
 
 def get_fallback_analysis():
@@ -193,10 +329,22 @@ def get_fallback_analysis():
             'Ready for immediate use'
         ],
         'description': 'Great condition second-hand item available for sale. Contact for more details.',
-        'price': '1000',
+        'price': 1000,
         'location': 'Not specified'
     }
 
+# Price ranges (INR) used by the fallback estimator, keyed by category keyword
+PRICE_RANGES = {
+    'furniture': (1000, 10000),
+    'electronics': (500, 20000),
+    'clothing': (200, 2000),
+    'books': (100, 500),
+    'toys': (200, 1000),
+    'kitchen': (300, 3000),
+    'sports': (500, 5000),
+}
+CATEGORY_RE = re.compile('|'.join(PRICE_RANGES))
+
 # Fallback price estimator if OpenAI is not available
 def estimate_price_fallback(image_or_category):
     """Simple fallback price estimation based on image or category
@@ -214,24 +362,13 @@ def estimate_price_fallback(image_or_category):
     
     # If input is a string (category), estimate price based on category
     if isinstance(image_or_category, str):
-        category = image_or_category.lower()
-        price_ranges = {
-            'furniture': (1000, 10000),
-            'electronics': (500, 20000),
-            'clothing': (200, 2000),
-            'books': (100, 500),
-            'toys': (200, 1000),
-            'kitchen': (300, 3000),
-            'sports': (500, 5000),
-        }
-        
-        for key in price_ranges:
-            if key in category:
-                min_price, max_price = price_ranges[key]
-                return np.random.randint(min_price, max_price)
+        match = CATEGORY_RE.search(image_or_category.lower())
+        if match:
+            min_price, max_price = PRICE_RANGES[match.group(0)]
+            return random.randrange(min_price, max_price)
         
         # Default range if category not found
-        return np.random.randint(500, 5000)
+        return random.randrange(500, 5000)
     
     # Default fallback if input type is unknown
     return get_fallback_analysis()
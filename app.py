@@ -2,27 +2,96 @@ import streamlit as st
 import os
 from PIL import Image
 import io
-from io import BytesIO
-import base64
+import hashlib
+import logging
+import shutil
 import time
-from datetime import datetime
-from dotenv import load_dotenv
+import diskcache
+from dotenv import load_dotenv, set_key
 
 # Load environment variables
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
-print(f"OPENAI_API_KEY loaded: {'Yes' if api_key else 'No'}")
-if api_key:
-    print(f"API Key: {api_key[:4]}...{api_key[-4:] if len(api_key) > 8 else 'INVALID'}")
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+logger.info("OPENAI_API_KEY loaded: %s", "Yes" if api_key else "No")
 
 # Import custom modules
-from ai_utils import analyze_image, estimate_price_fallback
-from flyer_generator import create_flyer, image_to_base64
-from share_utils import get_image_download_link, get_whatsapp_share_link
-from image_gen_utils import generate_product_image
-from marketplace_flyer import create_marketplace_flyer, format_price
+# (image_gen_utils is imported lazily in the Generate Image tab to keep cold start fast)
+from ai_utils import (analyze_image, estimate_price_fallback, get_fallback_analysis, get_openai_client,
+                      encode_pil_image_jpeg, MAX_IMAGE_EDGE)
+from share_utils import upload_image_for_analysis, get_flyer_download_data, get_png_bytes
 from flyer_gen_api import generate_marketplace_flyer, build_custom_prompt
 
+@st.cache_resource
+def get_analysis_disk_cache():
+    """Persistent analysis cache keyed by image content hash, opened once per process and survives app restarts"""
+    return diskcache.Cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# Lifetime in seconds of the pre-signed S3 URLs handed to the Vision API
+IMAGE_URL_TTL = 3600
+
+def analysis_image_urls(images, digests):
+    """Pre-signed S3 URLs so the Vision API can fetch the photos (None means send base64)
+    
+    The downscaled JPEG is uploaded, not the original file. URLs are kept per photo
+    for this session and re-signed by a fresh upload shortly before they expire.
+    """
+    if not os.getenv("S3_BUCKET"):
+        return None
+    
+    signed = st.session_state.setdefault('image_urls', {})
+    now = time.time()
+    urls = []
+    for image, digest in zip(images, digests):
+        url, expires_at = signed.get(digest, (None, 0))
+        if expires_at <= now:
+            url = upload_image_for_analysis(encode_pil_image_jpeg(image), "image/jpeg", expires_in=IMAGE_URL_TTL)
+            if url:
+                # Renew a minute early so the API never receives an expired link
+                signed[digest] = (url, now + IMAGE_URL_TTL - 60)
+        urls.append(url)
+    return urls
+
+def cached_analyze(images_bytes, use_fallback, images=None, on_partial=None):
+    """Analyze the bytes of one or more photos of an item, reusing earlier results for the same content
+    
+    Results are cached on disk only; fallback results are never stored, so a
+    failed or keyless analysis is retried on the next click.
+    
+    images may carry the already-decoded PIL images to avoid decoding the bytes again.
+    on_partial is only called on a cache miss, while the analysis streams in; cache
+    hits return without touching the UI.
+    """
+    digests = [hashlib.blake2b(image_bytes, digest_size=16).digest() for image_bytes in images_bytes]
+    key = ("analysis", hashlib.blake2b(b"".join(digests), digest_size=16).hexdigest(), use_fallback)
+    analysis_disk_cache = get_analysis_disk_cache()
+    result = analysis_disk_cache.get(key)
+    if result is not None:
+        return result
+    
+    if images is None:
+        images = [Image.open(io.BytesIO(b)) for b in images_bytes]
+    # Only upload on a miss, so cached photos never pay for the S3 round trip
+    image_urls = None if use_fallback else analysis_image_urls(images, digests)
+    result = analyze_image(images, use_fallback=use_fallback, image_url=image_urls, on_partial=on_partial)
+    # Only persist real API results so a transient failure isn't remembered
+    if result != get_fallback_analysis():
+        analysis_disk_cache.set(key, result)
+    return result
+
+def render_partial_analysis(placeholder, partial):
+    """Show the listing fields received so far while the analysis streams in"""
+    lines = []
+    for label in ("category", "title"):
+        if partial.get(label):
+            lines.append(f"**{label.title()}:** {partial[label]}")
+    lines.extend(f"- {feature}" for feature in partial.get('features', []))
+    if partial.get('price'):
+        lines.append(f"**Price:** ₹{partial['price']}")
+    placeholder.markdown("\n\n".join(lines))
+
 # Helper function to convert BytesIO to a file-like object for Streamlit
 def uploaded_file_to_bytes(bytes_io, filename):
     class UploadedFile:
@@ -53,14 +122,14 @@ st.markdown(
     .main {
         padding: 2rem;
     }
-    .stButton button {
+    .stButton button, .stFormSubmitButton button, .stDownloadButton button {
         background-color: #008080;
         color: white;
         border-radius: 5px;
         padding: 0.5rem 1rem;
         font-weight: bold;
     }
-    .stButton button:hover {
+    .stButton button:hover, .stFormSubmitButton button:hover, .stDownloadButton button:hover {
         background-color: #006666;
     }
     h1, h2, h3 {
@@ -90,6 +159,7 @@ st.markdown(
 # Initialize session state variables
 if 'uploaded_image' not in st.session_state:
     st.session_state.uploaded_image = None
+    st.session_state.uploaded_pil = None
     st.session_state.analysis_result = None
     st.session_state.flyer_image = None
     st.session_state.processing = False
@@ -125,6 +195,7 @@ with reset_col2:
         
         # Clear session state
         st.session_state.uploaded_image = None
+        st.session_state.uploaded_pil = None
         st.session_state.analysis_result = None
         st.session_state.flyer_image = None
         st.session_state.processing = False
@@ -158,20 +229,32 @@ with col1:
     upload_tab, generate_tab = st.tabs(["Upload Image", "Generate Image"])
 
     with upload_tab:
-        uploaded_file = st.file_uploader("Choose an image file", type=["jpg", "jpeg", "png"], key=f"file_uploader_{st.session_state.upload_key}")
+        uploaded_files = st.file_uploader("Choose image files (several angles of the same item)", type=["jpg", "jpeg", "png"],
+                                          accept_multiple_files=True, key=f"file_uploader_{st.session_state.upload_key}")
         
-        if uploaded_file is not None:
+        if uploaded_files:
             try:
-                # Read the image file
-                image_bytes = uploaded_file.getvalue()
-                image = Image.open(io.BytesIO(image_bytes))
+                # Read the image files
+                images_bytes = tuple(f.getvalue() for f in uploaded_files)
+                images = []
+                for image_bytes in images_bytes:
+                    image = Image.open(io.BytesIO(image_bytes))
+                    # For JPEGs, let libjpeg convert to RGB and downscale during decode (no-op for PNG)
+                    image.draft("RGB", (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+                    image.load()  # Decode once; reused for analysis and flyer generation
+                    images.append(image)
+                image = images[0]
                 
-                # Replace the dotted border with the actual image
+                # Replace the dotted border with the actual image(s)
                 with image_preview_placeholder:
-                    st.image(image, caption="Uploaded Image", use_column_width=True)
+                    if len(images) == 1:
+                        st.image(image, caption="Uploaded Image", use_container_width=True)
+                    else:
+                        st.image(images, caption=[f"Photo {i + 1}" for i in range(len(images))], width=150)
                 
-                # Store the uploaded image in session state
-                st.session_state.uploaded_image = uploaded_file
+                # Store the uploaded image in session state (the first photo is used for the flyer)
+                st.session_state.uploaded_image = uploaded_files[0]
+                st.session_state.uploaded_pil = image
                 st.session_state.image_source = "upload"
                 
                 # Add a single Analyze Image button that works in both modes
@@ -179,7 +262,12 @@ with col1:
                     if not st.session_state.use_fallback:
                         with st.spinner("🔍 Analyzing your image with AI..."):
                             st.session_state.processing = True
-                            st.session_state.analysis_result = analyze_image(image, use_fallback=st.session_state.use_fallback)
+                            partial_placeholder = st.empty()
+                            st.session_state.analysis_result = cached_analyze(
+                                images_bytes, st.session_state.use_fallback, images,
+                                lambda partial: render_partial_analysis(partial_placeholder, partial)
+                            )
+                            partial_placeholder.empty()
                             st.session_state.processing = False
                             st.rerun()
                     else:
@@ -191,9 +279,7 @@ with col1:
                             st.rerun()
             except Exception as e:
                 st.error(f"Error processing image: {e}")
-                print(f"Error processing uploaded image: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Error processing uploaded image")
 
     with generate_tab:
         st.markdown("Let AI generate a product image based on your description")
@@ -212,22 +298,22 @@ with col1:
             else:
                 with st.spinner("🎨 Generating your product image with AI..."):
                     try:
+                        from image_gen_utils import generate_product_image
                         generated_image = generate_product_image(product_description, product_category, image_style)
                         if generated_image:
                             # Replace the dotted border with the generated image
                             with image_preview_placeholder:
-                                st.image(generated_image, caption="Generated Product Image", use_column_width=True)
+                                st.image(generated_image, caption="Generated Product Image", use_container_width=True)
                             
                             # Save the generated image to a BytesIO object
-                            img_byte_arr = io.BytesIO()
-                            generated_image.save(img_byte_arr, format='PNG')
-                            img_byte_arr.seek(0)
+                            img_byte_arr = io.BytesIO(get_png_bytes(generated_image))
                             
                             # Create a file-like object for Streamlit
                             generated_file = uploaded_file_to_bytes(img_byte_arr, "generated_image.png")
                             
                             # Store in session state
                             st.session_state.uploaded_image = generated_file
+                            st.session_state.uploaded_pil = generated_image
                             st.session_state.image_source = "generated"
                             
                             if st.button("Use This Image", key="use_gen_img"):
@@ -244,9 +330,7 @@ with col1:
                             st.error("Failed to generate image. Please try again or use a different description.")
                     except Exception as e:
                         st.error(f"Error generating image: {e}")
-                        print(f"Error in image generation: {e}")
-                        import traceback
-                        traceback.print_exc()
+                        logger.exception("Error in image generation")
 
     # No need to close the div since we're handling it differently now
 
@@ -258,57 +342,70 @@ with col2:
         # Get values from analysis result
         result = st.session_state.analysis_result
         
-        # Create form fields for editing
-        new_category = st.text_input("Category", value=result.get('category', ''), key="category_input")
-        new_title = st.text_input("Title", value=result.get('title', ''), key="title_input")
-        
-        # Features as a text area with bullet points
-        features_text = '\n'.join([f"- {f}" for f in result.get('features', [])])
-        new_features_text = st.text_area("Features (one per line, starting with '-')", 
-                                       value=features_text, 
-                                       height=100,
-                                       key="features_input")
+        # Create form fields for editing (in a form so edits only rerun the script on submit)
+        with st.form("edit_form"):
+            new_category = st.text_input("Category", value=result.get('category', ''), key="category_input")
+            new_title = st.text_input("Title", value=result.get('title', ''), key="title_input")
+            
+            # Features as a text area with bullet points
+            features_text = '\n'.join([f"- {f}" for f in result.get('features', [])])
+            new_features_text = st.text_area("Features (one per line, starting with '-')", 
+                                           value=features_text, 
+                                           height=100,
+                                           key="features_input")
+            
+            # Price with ₹ symbol
+            price_value = str(result.get('price', 1000))
+            new_price = st.text_input("Price (₹)", value=price_value, key="price_input")
+            
+            # Location
+            new_location = st.text_input("Location", value=result.get('location', ''), key="location_input")
+            
+            # Add some spacing before the generate button
+            st.markdown("<br>", unsafe_allow_html=True)
+
+            # === Generate Flyer with OpenAI button ===
+            generate_clicked = st.form_submit_button("Generate Flyer with OpenAI")
         
         # Convert features text back to list
         new_features = [f.strip().lstrip('-').strip() for f in new_features_text.split('\n') if f.strip()]
-        
-        # Price with ₹ symbol
-        price_value = result.get('price', '1000')
-        new_price = st.text_input("Price (₹)", value=price_value, key="price_input")
-        
-        # Location
-        new_location = st.text_input("Location", value=result.get('location', ''), key="location_input")
-        
-        # Add some spacing before the generate button
-        st.markdown("<br>", unsafe_allow_html=True)
 
-        # === Generate Flyer with OpenAI button ===
-        if st.button("Generate Flyer with OpenAI", key="simple_generate_btn"):
+        if generate_clicked:
             progress = st.empty()
             try:
                 progress.info("🎨 Generating your professional flyer with OpenAI...")
 
                 # Update analysis_result with edits
-                st.session_state.analysis_result.update({
+                listing = {
                     'title': new_title,
                     'category': new_category,
                     'features': new_features,
                     'price': new_price,
                     'location': new_location
-                })
+                }
+                # Compare as strings since the analysis stores price as an int
+                edited = any(str(st.session_state.analysis_result.get(k)) != str(v) for k, v in listing.items())
+                st.session_state.analysis_result.update(listing)
+                if edited:
+                    # The analysis' flyer prompt no longer matches the listing
+                    st.session_state.analysis_result.pop('flyer_prompt', None)
 
-                # Build prompt and call API
-                image = Image.open(st.session_state.uploaded_image)
-                custom_prompt = build_custom_prompt(
-                    title=new_title,
-                    features=new_features,
-                    price=new_price,
-                    location=new_location,
-                    category=new_category
-                )
-                
                 # Use OpenAI API for flyer generation if enabled
                 use_api = st.session_state.use_api_flyer
+
+                # Use the flyer prompt from the analysis call when available, else build one
+                image = st.session_state.uploaded_pil
+                flyer_prompt = st.session_state.analysis_result.get('flyer_prompt')
+                if use_api and flyer_prompt:
+                    custom_prompt = flyer_prompt
+                else:
+                    custom_prompt = build_custom_prompt(
+                        title=new_title,
+                        features=new_features,
+                        price=new_price,
+                        location=new_location,
+                        category=new_category
+                    )
                 
                 # Show a spinner with appropriate message
                 if use_api:
@@ -319,6 +416,10 @@ with col2:
                 flyer = generate_marketplace_flyer(
                     image=image, 
                     custom_prompt=custom_prompt,
+                    title=new_title,
+                    features=new_features,
+                    price=new_price,
+                    location=new_location,
                     use_api=use_api
                 )
                 if not flyer:
@@ -329,29 +430,23 @@ with col2:
                 st.session_state.flyer_displayed_inline = True
                 progress.success("✅ Flyer generated successfully!")
                 st.subheader("Your Generated Flyer")
-                st.image(flyer, caption="Generated Marketplace Flyer", use_column_width=True)
+                st.image(flyer, caption="Generated Marketplace Flyer", use_container_width=True)
 
-                buf = io.BytesIO()
-                flyer.save(buf, format="PNG")
-                href = (
-                    f'<a href="data:file/png;base64,{base64.b64encode(buf.getvalue()).decode()}" '
-                    'download="marketplace_flyer.png">Download Flyer</a>'
-                )
-                st.markdown(href, unsafe_allow_html=True)
+                flyer_bytes, mime, ext = get_flyer_download_data(flyer)
+                st.download_button("Download Flyer", data=flyer_bytes, file_name=f"marketplace_flyer.{ext}",
+                                   mime=mime, key="download_flyer_inline", on_click="ignore")
 
             except Exception as e:
                 progress.error(f"❌ Error generating flyer: {e}")
-                print("Traceback (flyer generation):")
-                import traceback; traceback.print_exc()
+                logger.exception("Error generating flyer")
 
 # Display flyer outside editing if not inline
 if st.session_state.flyer_image and not st.session_state.get('flyer_displayed_inline', False):
     st.subheader("Your Generated Flyer")
-    st.image(st.session_state.flyer_image, caption="Generated Marketplace Flyer", use_column_width=True)
-    buf = io.BytesIO()
-    st.session_state.flyer_image.save(buf, format="PNG")
-    href = f'<a href="data:file/png;base64,{base64.b64encode(buf.getvalue()).decode()}" download="marketplace_flyer.png">Download Flyer</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    st.image(st.session_state.flyer_image, caption="Generated Marketplace Flyer", use_container_width=True)
+    flyer_bytes, mime, ext = get_flyer_download_data(st.session_state.flyer_image)
+    st.download_button("Download Flyer", data=flyer_bytes, file_name=f"marketplace_flyer.{ext}",
+                       mime=mime, key="download_flyer", on_click="ignore")
 
 # Footer with version info and credits
 st.markdown(
@@ -386,16 +481,15 @@ new_api_key = st.sidebar.text_input("Update OpenAI API Key", "", type="password"
 if new_api_key and st.sidebar.button("Update API Key"):
     os.environ["OPENAI_API_KEY"] = new_api_key
     env_path = os.path.join(os.path.dirname(__file__), ".env")
-    lines = open(env_path).read().splitlines()
-    with open(env_path, "w") as f:
-        for line in lines:
-            if line.startswith("OPENAI_API_KEY="):
-                f.write(f'OPENAI_API_KEY="{new_api_key}"\n')
-            else:
-                f.write(line + "\n")
     try:
-        from openai import OpenAI
-        _ = OpenAI(api_key=new_api_key)
+        # Update a copy next to .env and swap it in, so a crash can't leave .env half-written
+        tmp_path = env_path + ".tmp"
+        if os.path.exists(env_path):
+            shutil.copyfile(env_path, tmp_path)
+        set_key(tmp_path, "OPENAI_API_KEY", new_api_key)
+        os.replace(tmp_path, env_path)
+        # Warm the shared client for the new key (see ai_utils.get_openai_client)
+        get_openai_client(new_api_key)
         st.sidebar.success("API key updated successfully!")
         st.rerun()
     except Exception as e:
@@ -4,27 +4,37 @@ This module provides a simplified interface for generating marketplace flyers.
 """
 
 import os
-import base64
+import binascii
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import diskcache
+import ijson
 import io
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # Import local modules
 from marketplace_flyer import create_marketplace_flyer
-from ai_utils import analyze_image
+from ai_utils import get_openai_client
+from share_utils import get_png_bytes, get_jpeg_bytes
 
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
-try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    print("OpenAI client initialized for flyer generation")
-except Exception as e:
-    print(f"Error initializing OpenAI client for flyer generation: {e}")
-    client = None
+# Persistent HTTP session so successive flyer requests reuse the TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                       max_retries=Retry(total=2, backoff_factor=0.3)))
+
+# Worker threads for generate_marketplace_flyer_async
+_POOL = ThreadPoolExecutor(max_workers=4)
+
+# Generated flyers, keyed by image and prompt hash, persisted across sessions
+FLYER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "snapnsell", "flyers")
+flyer_cache = diskcache.Cache(FLYER_CACHE_DIR)
 
 def generate_marketplace_flyer(image, custom_prompt=None, title=None, features=None, price=None, location=None, contact_info=None, style="modern", use_api=True):
     """
@@ -51,7 +61,7 @@ def generate_marketplace_flyer(image, custom_prompt=None, title=None, features=N
         raise ValueError("Either custom_prompt or title, features, and price must be provided")
     
     # If API is not available or use_api is False, use the local flyer generator
-    if not use_api or client is None:
+    if not use_api or get_openai_client() is None:
         print("Using local flyer generator")
         return create_marketplace_flyer(
             image=image,
@@ -66,71 +76,145 @@ def generate_marketplace_flyer(image, custom_prompt=None, title=None, features=N
     
     # Use OpenAI API to generate the flyer
     print("Using OpenAI API for flyer generation")
-    return generate_flyer_with_openai(image, custom_prompt)
+    return generate_flyer_with_openai(image, custom_prompt, title=title, features=features,
+                                      price=price, location=location, contact_info=contact_info, style=style)
 
-def generate_flyer_with_openai(image, custom_prompt):
+def generate_marketplace_flyer_async(image, custom_prompt=None, title=None, features=None, price=None, location=None, contact_info=None, style="modern", use_api=True):
+    """
+    Start generate_marketplace_flyer on a background thread.
+    
+    PNG encoding (PIL releases the GIL) and the API upload (network I/O) run off the
+    calling thread, so several flyers requested back to back are generated concurrently.
+    Takes the same arguments as generate_marketplace_flyer.
+    
+    Returns:
+        concurrent.futures.Future resolving to the PIL Image of the flyer
+    """
+    return _POOL.submit(
+        generate_marketplace_flyer,
+        image,
+        custom_prompt=custom_prompt,
+        title=title,
+        features=features,
+        price=price,
+        location=location,
+        contact_info=contact_info,
+        style=style,
+        use_api=use_api
+    )
+
+def _prepare_flyer_prompt(custom_prompt):
+    """Make sure the prompt asks the image model for a marketplace flyer"""
+    if not custom_prompt:
+        return "Create a flyer to sell this product in WhatsApp or Facebook Marketplace"
+    # Ensure the prompt is focused on flyer generation
+    if "flyer" not in custom_prompt.lower() and "marketplace" not in custom_prompt.lower():
+        custom_prompt += "\n\nCreate a visually appealing marketplace flyer based on this information."
+    return custom_prompt
+
+def _request_flyer_edits(client, image_bytes, prompt, n=1, image_format="png"):
+    """
+    Request n flyer images from the OpenAI image edits endpoint in a single call.
+    
+    Results are cached on disk by a hash of the image and prompt, so repeating the
+    same request (common while iterating in the UI) skips the API entirely.
+    
+    Returns:
+        List of PNG bytes, one per generated flyer
+    """
+    cache_key = (hashlib.sha256(image_bytes).hexdigest(), hashlib.sha256(prompt.encode("utf-8")).hexdigest(), n)
+    cached = flyer_cache.get(cache_key)
+    if cached is not None and len(cached) == n:
+        print("Using cached flyer for this image and prompt")
+        return cached
+    
+    # Construct the multipart/form-data request
+    files = {
+        'image': (f'image.{image_format}', image_bytes, f'image/{image_format}'),  # filename, file content, file type
+    }
+    data = {'prompt': prompt, 'model': 'gpt-image-1', 'n': str(n)}
+    
+    # Make the request over the shared session
+    # Stream the body so the JSON is parsed straight off the socket instead of
+    # being buffered as bytes, then text, then a dict before decoding
+    with _SESSION.post(
+        "https://api.openai.com/v1/images/edits",
+        headers={"Authorization": f"Bearer {client.api_key}"},
+        files=files,
+        data=data,
+        stream=True,
+    ) as response:
+        if response.status_code != 200:
+            print(f"Error from OpenAI API: {response.status_code} - {response.text}")
+            raise ValueError(f"OpenAI API error: {response.status_code} - {response.text}")
+        
+        response.raw.decode_content = True  # Undo any gzip transfer encoding
+        flyers = [binascii.a2b_base64(b64_json) for b64_json in ijson.items(response.raw, 'data.item.b64_json')]
+    
+    # Never cache an incomplete response, or the failure would be replayed in every session
+    if len(flyers) != n:
+        raise ValueError(f"OpenAI API returned {len(flyers)} of {n} requested flyer images")
+    
+    flyer_cache.set(cache_key, flyers)
+    return flyers
+
+def generate_flyer_with_openai(image, custom_prompt, title=None, features=None, price=None, location=None, contact_info=None, style="modern"):
     """
     Generate a marketplace flyer using OpenAI's image generation API.
     
     Args:
         image: PIL Image object of the item
         custom_prompt: Custom prompt for flyer generation
+        title, features, price, location, contact_info, style: Item details used
+            by the local flyer generator if the API call fails (optional)
         
     Returns:
         PIL Image object of the generated flyer
     """
+    return generate_flyer_variants_with_openai(
+        image, custom_prompt, n=1, title=title, features=features, price=price,
+        location=location, contact_info=contact_info, style=style
+    )[0]
+
+def generate_flyer_variants_with_openai(image, custom_prompt, n=3, title=None, features=None, price=None, location=None, contact_info=None, style="modern"):
+    """
+    Generate several flyer variants for the same item in a single OpenAI API call.
+    
+    Args:
+        image: PIL Image object of the item
+        custom_prompt: Custom prompt for flyer generation
+        n: Number of variants to generate
+        title, features, price, location, contact_info, style: Item details used
+            by the local flyer generator if the API call fails (optional)
+        
+    Returns:
+        List of PIL Image objects (a single locally generated flyer if the API call fails)
+    """
+    client = get_openai_client()
     if client is None:
         raise ValueError("OpenAI client not initialized. Cannot generate flyer.")
     
     # Prepare the prompt
-    if not custom_prompt:
-        custom_prompt = "Create a flyer to sell this product in WhatsApp or Facebook Marketplace"
-    else:
-        # Ensure the prompt is focused on flyer generation
-        if "flyer" not in custom_prompt.lower() and "marketplace" not in custom_prompt.lower():
-            custom_prompt += "\n\nCreate a visually appealing marketplace flyer based on this information."
+    custom_prompt = _prepare_flyer_prompt(custom_prompt)
     
     print("Using prompt for flyer generation:")
     print(custom_prompt)
     
-    # Convert image to PNG format in memory
-    img_byte_arr = io.BytesIO()
-    
-    # If image is not RGB, convert it
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    
-    # Save as PNG
-    image.save(img_byte_arr, format="PNG")
-    img_byte_arr.seek(0)
-    image_bytes = img_byte_arr.getvalue()
+    # Photos without transparency upload as JPEG (far smaller than PNG); keep PNG for alpha.
+    # Encodings are cached on the image, so retries and later consumers reuse them.
+    if image.mode == "RGBA":
+        image_format = "png"
+        image_bytes = get_png_bytes(image)
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image_format = "jpeg"
+        image_bytes = get_jpeg_bytes(image)
     
     try:
-        # Construct the multipart/form-data request
-        files = {
-            'image': ('image.png', image_bytes, 'image/png'),  # filename, file content, file type
-        }
-        data = {'prompt': custom_prompt, 'model': 'gpt-image-1'}
-        
-        # Make the request using requests library
-        response = requests.post(
-            "https://api.openai.com/v1/images/edits",
-            headers={"Authorization": f"Bearer {client.api_key}"},
-            files=files,
-            data=data,
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            image_base64 = result['data'][0]['b64_json']
-            image_bytes = base64.b64decode(image_base64)
-            
-            # Convert to PIL Image
-            flyer_image = Image.open(io.BytesIO(image_bytes))
-            return flyer_image
-        else:
-            print(f"Error from OpenAI API: {response.status_code} - {response.text}")
-            raise ValueError(f"OpenAI API error: {response.status_code} - {response.text}")
+        flyers = _request_flyer_edits(client, image_bytes, custom_prompt, n, image_format)
+        # Convert to PIL Images
+        return [Image.open(io.BytesIO(flyer_bytes)) for flyer_bytes in flyers]
     
     except Exception as e:
         print(f"Error generating flyer with OpenAI: {e}")
@@ -138,10 +222,16 @@ def generate_flyer_with_openai(image, custom_prompt):
         traceback.print_exc()
         # Fall back to local flyer generation
         print("Falling back to local flyer generation")
-        return create_marketplace_flyer(
+        return [create_marketplace_flyer(
             image=image,
+            title=title,
+            features=features,
+            price=price,
+            location=location,
+            contact_info=contact_info,
+            style=style,
             custom_prompt=custom_prompt
-        )
+        )]
 
 def build_custom_prompt(title, features, price, location=None, category=None, condition=None, brand=None, age=None, additional_info=None):
     """
@@ -162,42 +252,41 @@ def build_custom_prompt(title, features, price, location=None, category=None, co
         A formatted prompt string for flyer generation
     """
     # Start with the title
-    prompt = f"Create a marketplace listing for: {title}"
+    parts = [f"Create a marketplace listing for: {title}"]
     
     # Add category if available
     if category:
-        prompt += f"\nCategory: {category}"
+        parts.append(f"Category: {category}")
     
     # Add features
     if features and len(features) > 0:
-        prompt += "\nFeatures:"
-        for feature in features:
-            prompt += f"\n- {feature}"
+        parts.append("Features:")
+        parts.extend(f"- {feature}" for feature in features)
     
     # Add price
-    prompt += f"\nPrice: ₹{price}"
+    parts.append(f"Price: ₹{price}")
     
     # Add location if available
     if location:
-        prompt += f"\nLocation: {location}"
+        parts.append(f"Location: {location}")
     
     # Add condition if available
     if condition:
-        prompt += f"\nCondition: {condition}"
+        parts.append(f"Condition: {condition}")
     
     # Add brand if available
     if brand:
-        prompt += f"\nBrand: {brand}"
+        parts.append(f"Brand: {brand}")
     
     # Add age if available
     if age:
-        prompt += f"\nAge: {age}"
+        parts.append(f"Age: {age}")
     
     # Add additional info if available
     if additional_info:
-        prompt += f"\nAdditional Information: {additional_info}"
+        parts.append(f"Additional Information: {additional_info}")
     
     # Add final instruction
-    prompt += "\n\nPlease create a visually appealing marketplace listing flyer based on the above information."
+    parts.append("\nPlease create a visually appealing marketplace listing flyer based on the above information.")
     
-    return prompt
+    return "\n".join(parts)
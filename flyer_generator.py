@@ -1,8 +1,10 @@
 from PIL import Image, ImageDraw, ImageFont
 import os
-import io
-import base64
+import threading
 from datetime import datetime
+from functools import lru_cache
+from share_utils import get_png_b64
+from flyer_utils import INR_GROUP_RE, PRICE_STRIP_TABLE, measure_text, footer, wrap_text
 
 # Define constants for flyer design
 TEAL_COLOR = (0, 128, 128)
@@ -29,6 +31,48 @@ except Exception:
     PRICE_FONT = ImageFont.load_default()
     FOOTER_FONT = ImageFont.load_default()
 
+# Approximate line height for each flyer font, measured once at load
+_LINE_H = {id(f): f.getbbox("Ay")[3] * 1.5
+           for f in (TITLE_FONT, SUBTITLE_FONT, BODY_FONT, PRICE_FONT, FOOTER_FONT)}
+
+# Sizes of constant header/footer text, measured once rather than per flyer
+APP_NAME = "Snap & Sell"
+_APP_NAME_W, _APP_NAME_H = measure_text(TITLE_FONT, APP_NAME)
+
+@lru_cache(maxsize=8)
+def _flyer_template(flyer_width, flyer_height, current_date):
+    """
+    Render the parts of the flyer that don't depend on the item (background,
+    header with app name, dated footer). Callers must copy() the result.
+    """
+    # Create a new image with white background
+    flyer = Image.new('RGB', (flyer_width, flyer_height), WHITE_COLOR)
+    draw = ImageDraw.Draw(flyer)
+    
+    # Draw header with teal background
+    draw.rectangle([(0, 0), (flyer_width, 120)], fill=TEAL_COLOR)
+    
+    # Draw app name
+    draw.text(
+        ((flyer_width - _APP_NAME_W) // 2, 40), 
+        APP_NAME, 
+        fill=WHITE_COLOR, 
+        font=TITLE_FONT
+    )
+    
+    # Draw footer
+    footer_y = flyer_height - 60
+    footer_text, (w, h) = footer(FOOTER_FONT, current_date)
+        
+    draw.text(
+        ((flyer_width - w) // 2, footer_y), 
+        footer_text, 
+        fill=GRAY_COLOR, 
+        font=FOOTER_FONT
+    )
+    
+    return flyer
+
 def create_flyer(image, title, category, description, price):
     """
     Create a flyer image with the provided information
@@ -43,30 +87,13 @@ def create_flyer(image, title, category, description, price):
     Returns:
         PIL Image object of the generated flyer
     """
-    # Create a new image with white background
+    # Start from the pre-rendered header and footer for today's date
     flyer_width = 1200
     flyer_height = 1600
-    flyer = Image.new('RGB', (flyer_width, flyer_height), WHITE_COLOR)
+    current_date = datetime.now().strftime("%d %b %Y")
+    flyer = _flyer_template(flyer_width, flyer_height, current_date).copy()
     draw = ImageDraw.Draw(flyer)
     
-    # Draw header with teal background
-    draw.rectangle([(0, 0), (flyer_width, 120)], fill=TEAL_COLOR)
-    
-    # Draw app name
-    app_name = "Snap & Sell"
-    try:
-        w, h = draw.textsize(app_name, font=TITLE_FONT)
-    except:
-        # For newer PIL versions
-        w, h = TITLE_FONT.getbbox(app_name)[2:4]
-    
-    draw.text(
-        ((flyer_width - w) // 2, 40), 
-        app_name, 
-        fill=WHITE_COLOR, 
-        font=TITLE_FONT
-    )
-    
     # Resize and center the main image
     target_height = 600
     img_width, img_height = image.size
@@ -76,7 +103,17 @@ def create_flyer(image, title, category, description, price):
         new_width = flyer_width - 100
         target_height = int(img_height * (new_width / img_width))
     
-    resized_img = image.resize((new_width, target_height), Image.LANCZOS)
+    scale = new_width / img_width
+    if 0.95 <= scale <= 1.05 and img_width <= flyer_width - 100:
+        # Already within 5% of the target size; use the photo as-is
+        resized_img = image
+        new_width, target_height = img_width, img_height
+    else:
+        factor = int(img_width // (new_width * 2))
+        if factor > 1 and image.mode in ("L", "RGB", "RGBA"):
+            # Box-downsample to roughly twice the target before the costlier LANCZOS pass
+            image = image.reduce(factor)
+        resized_img = image.resize((new_width, target_height), Image.LANCZOS)
     
     # Calculate position to center the image
     img_pos_x = (flyer_width - new_width) // 2
@@ -127,16 +164,7 @@ def create_flyer(image, title, category, description, price):
     # Draw price
     # Use 'Rs.' instead of ₹ symbol to avoid encoding issues
     price_text = f"Rs. {formatted_price}"
-    try:
-        w, h = draw.textsize(price_text, font=PRICE_FONT)
-    except Exception as e:
-        try:
-            # For newer PIL versions
-            w, h = PRICE_FONT.getbbox(price_text)[2:4]
-        except Exception as e:
-            print(f"Error getting text size: {e}")
-            # Fallback to estimated size
-            w, h = len(price_text) * 20, 50
+    w, h = measure_text(PRICE_FONT, price_text)
         
     draw.text(
         ((flyer_width - w) // 2, price_box_y + 25), 
@@ -145,53 +173,16 @@ def create_flyer(image, title, category, description, price):
         font=PRICE_FONT
     )
     
-    # Draw footer
-    footer_y = flyer_height - 60
-    current_date = datetime.now().strftime("%d %b %Y")
-    # Use a hyphen instead of bullet point to avoid encoding issues
-    footer_text = f"Created with Snap & Sell - {current_date}"
-    
-    try:
-        w, h = draw.textsize(footer_text, font=FOOTER_FONT)
-    except:
-        # For newer PIL versions
-        w, h = FOOTER_FONT.getbbox(footer_text)[2:4]
-        
-    draw.text(
-        ((flyer_width - w) // 2, footer_y), 
-        footer_text, 
-        fill=GRAY_COLOR, 
-        font=FOOTER_FONT
-    )
-    
     return flyer
 
 def draw_wrapped_text(draw, text, x, y, max_width, font, color):
     """Draw text wrapped to fit within max_width"""
-    words = text.split()
-    lines = []
-    current_line = words[0]
-    
-    for word in words[1:]:
-        try:
-            # Check if adding this word exceeds max width
-            test_line = current_line + " " + word
-            w, h = draw.textsize(test_line, font=font)
-        except:
-            # For newer PIL versions
-            test_line = current_line + " " + word
-            w, h = font.getbbox(test_line)[2:4]
-            
-        if w <= max_width:
-            current_line = test_line
-        else:
-            lines.append(current_line)
-            current_line = word
-    
-    lines.append(current_line)
+    lines = wrap_text(text, max_width, font)
     
     # Draw each line
-    line_height = font.getbbox("Ay")[3] * 1.5  # Approximate line height
+    line_height = _LINE_H.get(id(font))
+    if line_height is None:
+        line_height = font.getbbox("Ay")[3] * 1.5  # Approximate line height
     for i, line in enumerate(lines):
         draw.text((x, y + i * line_height), line, fill=color, font=font)
     
@@ -199,20 +190,70 @@ def draw_wrapped_text(draw, text, x, y, max_width, font, color):
 
 def format_price(price):
     """Format price with commas for thousands (Indian format)"""
-    price = str(price).replace(',', '').replace('₹', '')
+    price = str(price).translate(PRICE_STRIP_TABLE)
     price = int(float(price))
     
     # Indian number format (lakhs and crores)
-    s = str(price)
-    if len(s) <= 3:
-        return s
-    elif len(s) <= 5:
-        return s[:-3] + ',' + s[-3:]
-    else:
-        return s[:-5] + ',' + s[-5:-3] + ',' + s[-3:]
+    return INR_GROUP_RE.sub(r"\1,", str(price))
+
+# Optional JIT kernel for formatting many prices at once; single calls stay on
+# format_price so they never pay Numba's first-call compile cost
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
+
+_fmt_buffers = threading.local()
+
+# Longest int64 the kernel accepts: 19 digits + 8 grouping commas + sign. Negating
+# int64's minimum overflows, so the kernel's range is symmetric and excludes it.
+_FMT_BUFFER_LEN = 28
+_FMT_MAX = 2**63 - 1
+
+if njit is not None:
+    @njit(cache=True)
+    def _fmt_inr(n, out):
+        """Write n into out with Indian grouping, right-aligned; return the start index"""
+        neg = n < 0
+        if neg:
+            n = -n
+        i = out.shape[0]
+        digits = 0
+        while True:
+            if digits == 3 or (digits > 3 and digits % 2 == 1):
+                i -= 1
+                out[i] = 44  # ','
+            i -= 1
+            out[i] = 48 + n % 10
+            n //= 10
+            digits += 1
+            if n == 0:
+                break
+        if neg:
+            i -= 1
+            out[i] = 45  # '-'
+        return i
+
+def format_prices(prices):
+    """Format a batch of prices in Indian format, using the Numba kernel when available"""
+    if njit is None:
+        return [format_price(p) for p in prices]
+
+    out = getattr(_fmt_buffers, "out", None)
+    if out is None:
+        out = _fmt_buffers.out = np.empty(_FMT_BUFFER_LEN, np.uint8)
+
+    formatted = []
+    for price in prices:
+        value = int(float(str(price).translate(PRICE_STRIP_TABLE)))
+        if -_FMT_MAX <= value <= _FMT_MAX:
+            start = _fmt_inr(value, out)
+            formatted.append(out[start:].tobytes().decode())
+        else:
+            formatted.append(format_price(value))
+    return formatted
 
 def image_to_base64(img):
     """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return get_png_b64(img)
@@ -0,0 +1,48 @@
+import re
+from functools import lru_cache
+
+# Inserts Indian-style grouping commas: last three digits, then pairs (e.g. 12,34,567)
+INR_GROUP_RE = re.compile(r"(\d)(?=(?:\d\d)*\d{3}$)")
+
+# Characters stripped from a price before formatting
+PRICE_STRIP_TABLE = str.maketrans("", "", ",₹")
+
+def measure_text(font, text):
+    """Width and height of text in font (getbbox; requirements pin Pillow >= 9.2)"""
+    return font.getbbox(text)[2:4]
+
+@lru_cache(maxsize=4)
+def footer(font, current_date):
+    """Flyer footer text and its size, which only change with the date"""
+    # Use a hyphen instead of bullet point to avoid encoding issues
+    text = f"Created with Snap & Sell - {current_date}"
+    return text, measure_text(font, text)
+
+@lru_cache(maxsize=4096)
+def _text_width(font, text):
+    """Advance width of text in font, cached so repeated words skip FreeType measurement"""
+    return font.getlength(text)
+
+def wrap_text(text, max_width, font):
+    """Split text into lines no wider than max_width, measuring each word once"""
+    words = text.split()
+    if not words:
+        return []
+
+    lines = []
+    space_width = _text_width(font, " ")
+    current_line = [words[0]]
+    current_width = _text_width(font, words[0])
+
+    for word in words[1:]:
+        word_width = _text_width(font, word)
+        if current_width + space_width + word_width <= max_width:
+            current_line.append(word)
+            current_width += space_width + word_width
+        else:
+            lines.append(" ".join(current_line))
+            current_line = [word]
+            current_width = word_width
+
+    lines.append(" ".join(current_line))
+    return lines
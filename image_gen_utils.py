@@ -1,9 +1,10 @@
 import os
-import base64
-from openai import OpenAI
+import binascii
 from dotenv import load_dotenv
 from PIL import Image
 from io import BytesIO
+from ai_utils import get_openai_client
+from share_utils import get_png_bytes
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
@@ -13,14 +14,6 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     print("Warning: OpenAI API key not found in environment variables")
 
-# Initialize OpenAI client
-try:
-    client = OpenAI(api_key=api_key)
-    print("OpenAI client initialized successfully for image generation")
-except Exception as e:
-    print(f"Error initializing OpenAI client for image generation: {e}")
-    client = None
-
 def generate_product_image(description, category=None, style="photorealistic"):
     """
     Generate a product image using OpenAI's GPT-Image-1 model
@@ -33,6 +26,7 @@ def generate_product_image(description, category=None, style="photorealistic"):
     Returns:
         PIL Image object of the generated image
     """
+    client = get_openai_client()
     if client is None:
         print("OpenAI client not initialized. Cannot generate image.")
         return None
@@ -57,7 +51,7 @@ def generate_product_image(description, category=None, style="photorealistic"):
         image_base64 = result.data[0].b64_json
         
         # Convert base64 to PIL Image
-        image_bytes = base64.b64decode(image_base64)
+        image_bytes = binascii.a2b_base64(image_base64)
         image = Image.open(BytesIO(image_bytes))
         
         return image
@@ -78,14 +72,13 @@ def enhance_product_image(original_image, description=None, category=None):
     Returns:
         PIL Image object of the enhanced image
     """
+    client = get_openai_client()
     if client is None:
         print("OpenAI client not initialized. Cannot enhance image.")
         return original_image
     
-    # Convert PIL image to base64
-    buffered = BytesIO()
-    original_image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    # Encode PIL image as PNG for upload
+    png_bytes = get_png_bytes(original_image)
     
     # Create a prompt for the image enhancement
     if description and category:
@@ -99,7 +92,7 @@ def enhance_product_image(original_image, description=None, category=None):
         # Generate the enhanced image
         result = client.images.edit(
             model="gpt-image-1",
-            image=img_str,
+            image=("image.png", png_bytes, "image/png"),
             prompt=prompt,
             n=1,  # Number of images to generate
             size="1024x1024",  # Image size
@@ -110,7 +103,7 @@ def enhance_product_image(original_image, description=None, category=None):
         image_base64 = result.data[0].b64_json
         
         # Convert base64 to PIL Image
-        image_bytes = base64.b64decode(image_base64)
+        image_bytes = binascii.a2b_base64(image_base64)
         image = Image.open(BytesIO(image_bytes))
         
         return image
@@ -1,8 +1,9 @@
 import os
+import re
 from PIL import Image, ImageDraw, ImageFont
-import io
-import base64
 from datetime import datetime
+from functools import lru_cache
+from flyer_utils import INR_GROUP_RE, PRICE_STRIP_TABLE, measure_text, footer, wrap_text
 
 # Define constants for flyer design
 TEAL_COLOR = (0, 128, 128)
@@ -12,6 +13,9 @@ GRAY_COLOR = (100, 100, 100)
 BLACK_COLOR = (0, 0, 0)
 LIGHT_GRAY = (240, 240, 240)
 
+# Digit runs in a price string
+_DIGITS_RE = re.compile(r"\d+")
+
 # Get the directory of the current script
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -31,6 +35,44 @@ except Exception:
     PRICE_FONT = ImageFont.load_default()
     FOOTER_FONT = ImageFont.load_default()
 
+@lru_cache(maxsize=8)
+def _marketplace_template(style, flyer_width, flyer_height, current_date):
+    """
+    Render the parts of the marketplace flyer that don't depend on the item
+    (background, WhatsApp icon, dated footer). Callers must copy() the result.
+    """
+    # Create a new image with cream background
+    flyer = Image.new('RGB', (flyer_width, flyer_height), CREAM_COLOR)
+    draw = ImageDraw.Draw(flyer)
+    
+    # The call to action sits at a fixed height; the icon is drawn next to it
+    cta_y = flyer_height - 150
+    
+    # Draw WhatsApp icon
+    whatsapp_icon_size = 40
+    icon_x = flyer_width - 80
+    icon_y = cta_y - 5
+    
+    # Draw a circle for WhatsApp icon
+    draw.ellipse(
+        [(icon_x, icon_y), 
+         (icon_x + whatsapp_icon_size, icon_y + whatsapp_icon_size)], 
+        fill=(37, 211, 102)  # WhatsApp green
+    )
+    
+    # Draw footer
+    footer_y = flyer_height - 40
+    footer_text, (w, h) = footer(FOOTER_FONT, current_date)
+        
+    draw.text(
+        ((flyer_width - w) // 2, footer_y), 
+        footer_text, 
+        fill=GRAY_COLOR, 
+        font=FOOTER_FONT
+    )
+    
+    return flyer
+
 def create_marketplace_flyer(image, title=None, features=None, price=None, location=None, contact_info=None, style="modern", custom_prompt=None):
     """
     Create a marketplace flyer image with the provided information
@@ -48,10 +90,11 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
     Returns:
         PIL Image object of the generated flyer
     """
-    # Create a new image with cream background
+    # Start from the pre-rendered background, WhatsApp icon and footer for today's date
     flyer_width = 800
     flyer_height = 1200
-    flyer = Image.new('RGB', (flyer_width, flyer_height), CREAM_COLOR)
+    current_date = datetime.now().strftime('%d %b %Y')
+    flyer = _marketplace_template(style, flyer_width, flyer_height, current_date).copy()
     draw = ImageDraw.Draw(flyer)
     
     # Draw title at the top
@@ -63,11 +106,7 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
             title = "ITEM FOR SALE"
     
     title = title.upper()
-    try:
-        w, h = draw.textsize(title, font=TITLE_FONT)
-    except:
-        # For newer PIL versions
-        w, h = TITLE_FONT.getbbox(title)[2:4]
+    w, h = measure_text(TITLE_FONT, title)
     
     draw.text(
         ((flyer_width - w) // 2, 40), 
@@ -85,7 +124,17 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
         new_width = flyer_width - 80
         target_height = int(img_height * (new_width / img_width))
     
-    resized_img = image.resize((new_width, target_height), Image.LANCZOS)
+    scale = new_width / img_width
+    if 0.95 <= scale <= 1.05 and img_width <= flyer_width - 80:
+        # Already within 5% of the target size; use the photo as-is
+        resized_img = image
+        new_width, target_height = img_width, img_height
+    else:
+        factor = int(img_width // (new_width * 2))
+        if factor > 1 and image.mode in ("L", "RGB", "RGBA"):
+            # Box-downsample to roughly twice the target before the costlier LANCZOS pass
+            image = image.reduce(factor)
+        resized_img = image.resize((new_width, target_height), Image.LANCZOS)
     
     # Calculate position to center the image
     img_pos_x = (flyer_width - new_width) // 2
@@ -124,13 +173,15 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
     for feature in features:
         # Use a simple dash instead of bullet point to avoid encoding issues
         feature_text = f"- {feature}"
-        draw.text(
-            (40, bullet_y), 
-            feature_text, 
-            fill=BLACK_COLOR, 
-            font=BODY_FONT
-        )
-        bullet_y += 40
+        # Wrap long features; continuation lines are drawn at the same left margin
+        for line in wrap_text(feature_text, flyer_width - 80, BODY_FONT):
+            draw.text(
+                (40, bullet_y), 
+                line, 
+                fill=BLACK_COLOR, 
+                font=BODY_FONT
+            )
+            bullet_y += 40
     
     # Draw price
     price_y = bullet_y + 40
@@ -142,7 +193,7 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
             try:
                 price_text = custom_prompt.split("Price:")[1].split("\n")[0].strip()
                 # Extract just the digits
-                price = ''.join(c for c in price_text if c.isdigit())
+                price = "".join(_DIGITS_RE.findall(price_text))
                 if not price:
                     price = "1000"  # Default price
             except:
@@ -194,50 +245,15 @@ def create_marketplace_flyer(image, title=None, features=None, price=None, locat
         font=SUBTITLE_FONT
     )
     
-    # Draw WhatsApp icon
-    whatsapp_icon_size = 40
-    icon_x = flyer_width - 80
-    icon_y = cta_y - 5
-    
-    # Draw a circle for WhatsApp icon
-    draw.ellipse(
-        [(icon_x, icon_y), 
-         (icon_x + whatsapp_icon_size, icon_y + whatsapp_icon_size)], 
-        fill=(37, 211, 102)  # WhatsApp green
-    )
-    
-    # Draw footer
-    footer_y = flyer_height - 40
-    footer_text = f"Created with Snap & Sell - {datetime.now().strftime('%d %b %Y')}"
-    
-    try:
-        w, h = draw.textsize(footer_text, font=FOOTER_FONT)
-    except:
-        # For newer PIL versions
-        w, h = FOOTER_FONT.getbbox(footer_text)[2:4]
-        
-    draw.text(
-        ((flyer_width - w) // 2, footer_y), 
-        footer_text, 
-        fill=GRAY_COLOR, 
-        font=FOOTER_FONT
-    )
-    
     return flyer
 
 def format_price(price):
     """Format price with commas for thousands (Indian format)"""
-    price = str(price).replace(',', '').replace('Rs.', '').replace('₹', '')
+    price = str(price).replace('Rs.', '').translate(PRICE_STRIP_TABLE)
     try:
         price = int(float(price))
         
         # Indian number format (lakhs and crores)
-        s = str(price)
-        if len(s) <= 3:
-            return s
-        elif len(s) <= 5:
-            return s[:-3] + ',' + s[-3:]
-        else:
-            return s[:-5] + ',' + s[-5:-3] + ',' + s[-3:]
+        return INR_GROUP_RE.sub(r"\1,", str(price))
     except:
         return price
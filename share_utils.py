@@ -1,8 +1,77 @@
 import os
-import base64
-import pyshorteners
+import binascii
+import hashlib
+import requests
 from io import BytesIO
-from PIL import Image
+from PIL import Image, ImageFile
+from requests.adapters import HTTPAdapter
+
+# Keep-alive session for URL shortening, so repeated shares reuse the TinyURL connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+def get_png_bytes(img):
+    """
+    Encode a PIL Image as PNG, caching the result on the image
+    
+    Uses fast compression (level 1); the encoded bytes are reused by every
+    later caller, so an image is only DEFLATE-encoded once.
+    
+    Args:
+        img: PIL Image (must not be modified after the first call)
+        
+    Returns:
+        PNG-encoded bytes
+    """
+    png_bytes = getattr(img, "_cached_png", None)
+    if png_bytes is None:
+        # Let the encoder write the whole image in one pass instead of joining small chunks;
+        # MAXBLOCK is process-wide, so restore it for every other save
+        maxblock = ImageFile.MAXBLOCK
+        ImageFile.MAXBLOCK = max(maxblock, img.width * img.height * 4)
+        buffered = BytesIO()
+        try:
+            img.save(buffered, format="PNG", compress_level=1)
+        finally:
+            ImageFile.MAXBLOCK = maxblock
+        png_bytes = buffered.getvalue()
+        img._cached_png = png_bytes
+    return png_bytes
+
+def get_png_b64(img):
+    """
+    Base64-encode a PIL Image's PNG bytes, caching the string on the image
+    
+    Args:
+        img: PIL Image (must not be modified after the first call)
+        
+    Returns:
+        Base64 string of the PNG encoding
+    """
+    png_b64 = getattr(img, "_cached_png_b64", None)
+    if png_b64 is None:
+        png_b64 = binascii.b2a_base64(get_png_bytes(img), newline=False).decode("ascii")
+        img._cached_png_b64 = png_b64
+    return png_b64
+
+def get_jpeg_bytes(img, quality=92):
+    """
+    Encode an RGB PIL Image as JPEG, caching the result on the image
+    
+    Args:
+        img: PIL Image in RGB mode (must not be modified after the first call)
+        quality: JPEG quality
+        
+    Returns:
+        JPEG-encoded bytes
+    """
+    cached = getattr(img, "_cached_jpeg", None)
+    if cached is None or cached[0] != quality:
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG", quality=quality, optimize=False)
+        cached = (quality, buffered.getvalue())
+        img._cached_jpeg = cached
+    return cached[1]
 
 def get_image_download_link(img, filename="flyer.png", text="Download Flyer"):
     """
@@ -16,12 +85,37 @@ def get_image_download_link(img, filename="flyer.png", text="Download Flyer"):
     Returns:
         HTML string with download link
     """
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    img_str = get_png_b64(img)
     href = f'<a href="data:image/png;base64,{img_str}" download="{filename}">{text}</a>'
     return href
 
+def get_flyer_download_data(img):
+    """
+    Encode a flyer compactly for download
+    
+    Uses WebP, falling back to optimized JPEG (or PNG if the flyer has
+    transparency) when Pillow was built without WebP support.
+    
+    Args:
+        img: PIL Image
+        
+    Returns:
+        Tuple of (encoded bytes, MIME type, file extension)
+    """
+    buffered = BytesIO()
+    try:
+        img.save(buffered, format="WEBP", quality=85, method=6)
+        return buffered.getvalue(), "image/webp", "webp"
+    except (KeyError, OSError):
+        buffered = BytesIO()
+    
+    if img.mode in ("RGBA", "LA", "P"):
+        img.save(buffered, format="PNG")
+        return buffered.getvalue(), "image/png", "png"
+    
+    img.convert("RGB").save(buffered, format="JPEG", quality=90, optimize=True, progressive=True)
+    return buffered.getvalue(), "image/jpeg", "jpg"
+
 def get_whatsapp_share_link(img, title, price):
     """
     Generate a WhatsApp share link with the flyer image
@@ -60,13 +154,42 @@ def create_short_url(url):
         Shortened URL
     """
     try:
-        # Initialize the shortener
-        s = pyshorteners.Shortener()
-        
-        # Shorten the URL
-        short_url = s.tinyurl.short(url)
-        
-        return short_url
+        r = _SESSION.get("https://tinyurl.com/api-create.php", params={"url": url}, timeout=3)
+        return r.text.strip() if r.ok else url
     except Exception as e:
         print(f"Error creating short URL: {e}")
         return url
+
+def upload_image_for_analysis(image_bytes, content_type="image/jpeg", expires_in=3600):
+    """
+    Upload image bytes to S3 and return a pre-signed URL for the Vision API
+    
+    Requires boto3 and the S3_BUCKET environment variable. The object key is
+    derived from the image content, so re-uploading the same photo reuses it.
+    
+    Args:
+        image_bytes: Raw bytes of the uploaded image
+        content_type: MIME type of the image
+        expires_in: Lifetime of the pre-signed URL in seconds
+        
+    Returns:
+        Pre-signed URL, or None if S3 is not configured or the upload fails
+    """
+    bucket = os.getenv("S3_BUCKET")
+    if not bucket:
+        return None
+    
+    try:
+        import boto3
+        
+        s3 = boto3.client("s3")
+        key = f"uploads/{hashlib.sha256(image_bytes).hexdigest()}"
+        s3.put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType=content_type)
+        return s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": key},
+            ExpiresIn=expires_in
+        )
+    except Exception as e:
+        print(f"Error uploading image to S3: {e}")
+        return None